@@ -1,21 +1,29 @@
+import io
 import os
+import re
+import sqlite3
 from pathlib import Path
 
 import pandas as pd
 import streamlit as st
 
 from data.database import (
+    DTYPES,
     init_db,
     archivo_ya_procesado,
-    registrar_archivo_procesado,
-    insertar_en_db,
-    fetch_all,
+    insertar_lote,
+    fetch_all_df,
+    rows_to_df,
+    fetch_pending,
     update_rows,
     mark_rows_as_kame,
     reset_db,
 )
 from data.extractor_internacional import leer_cartola_internacional
-from dashboard import show_dashboard
+from dashboard import clear_cache as clear_dashboard_cache, show_dashboard
+
+# Filtered/sorted views share buffers until written to
+pd.options.mode.copy_on_write = True
 
 
 TIPO_GASTO_OPTIONS = [
@@ -35,7 +43,6 @@ TIPO_GASTO_OPTIONS = [
     "Hubspot",
 ]
 
-
 # =========================
 # Password protection
 # =========================
@@ -61,6 +68,7 @@ def require_password():
         st.stop()
 
 
+@st.cache_resource
 def _get_base_path() -> str:
     candidates = ["/mount/src/vs_bci_internacional", "/mount", "."]
     for c in candidates:
@@ -75,6 +83,73 @@ def _get_base_path() -> str:
     return "."
 
 
+@st.cache_resource
+def _get_conn(db_path: str) -> sqlite3.Connection:
+    """One connection per process: DDL/PRAGMAs run once, not on every rerun."""
+    return init_db(db_path)
+
+
+@st.cache_data(show_spinner=False)
+def _parse_pdf(pdf_bytes: bytes, filename: str) -> list:
+    """PDF parsing is the slow part of ingest; cached by content (+ filename)."""
+    return leer_cartola_internacional(pdf_bytes, filename=filename)
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _load_df(db_path: str, mtime: float) -> pd.DataFrame:
+    """Load the full table; cached until the DB file changes (mtime) or .clear()."""
+    # Reuse the process-wide connection (PRAGMAs set, statement cache warm)
+    return fetch_all_df(_get_conn(db_path), dtype=DTYPES)
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _csv_bytes(db_path: str, mtime: float) -> bytes:
+    """CSV export of the whole table, rebuilt only when the DB changes."""
+    # Write straight to bytes (no intermediate str + encode copy)
+    buf = io.BytesIO()
+    _load_df(db_path, mtime).to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+
+def _clear_caches() -> None:
+    """Drop every DB-derived cache after a write."""
+    _load_df.clear()
+    _csv_bytes.clear()
+    clear_dashboard_cache()
+
+
+def _update_payload(df: pd.DataFrame) -> list:
+    """(TIPO_GASTO, CONCILIADO, _RID_) tuples for update_rows."""
+    # .tolist() -> native Python ints (sqlite3 can't bind numpy scalars)
+    return list(zip(
+        df["TIPO_GASTO"].fillna("").tolist(),
+        df["CONCILIADO"].fillna(False).astype(bool).astype(int).tolist(),
+        df["_RID_"].astype(int).tolist(),
+    ))
+
+
+def _changed_rows(edited: pd.DataFrame, snapshot: pd.DataFrame) -> pd.DataFrame:
+    """Rows whose TIPO_GASTO / CONCILIADO differ from what was shown in the editor."""
+    tipo_changed = (
+        edited["TIPO_GASTO"].fillna("").to_numpy()
+        != snapshot["TIPO_GASTO"].fillna("").to_numpy()
+    )
+    conc_changed = (
+        edited["CONCILIADO"].fillna(False).astype(bool).to_numpy()
+        != snapshot["CONCILIADO"].fillna(False).astype(bool).to_numpy()
+    )
+    return edited[tipo_changed | conc_changed]
+
+
+def _db_mtime(db_path: str) -> float:
+    """Last write time of the DB, including its WAL file (commits land there first)."""
+    mtimes = [os.path.getmtime(db_path)]
+    wal_path = db_path + "-wal"
+    if os.path.exists(wal_path):
+        mtimes.append(os.path.getmtime(wal_path))
+    return max(mtimes)
+
+
 def main():
     st.set_page_config(page_title="BCI Internacional", layout="wide")
 
@@ -85,7 +160,7 @@ def main():
 
     base_path = _get_base_path()
     db_path = str(Path(base_path) / "cartolas_bci_internacional.db")
-    conn = init_db(db_path)
+    conn = _get_conn(db_path)
 
     # -------------------------
     # 1) Upload PDFs
@@ -99,58 +174,78 @@ def main():
         value="",
         help="Ej: PAGO, TOTAL, ABONO",
     )
-    exclude_terms = [t.strip().lower()
-                     for t in exclude_terms_raw.split(",") if t.strip()]
+    exclude_pat = "|".join(re.escape(t.strip())
+                           for t in exclude_terms_raw.split(",") if t.strip())
+    exclude_re = re.compile(exclude_pat, re.IGNORECASE) if exclude_pat else None
+
+    # Summary of the last ingest (set right before its st.rerun)
+    ingest_msg = st.session_state.pop("ingest_msg", None)
+    if ingest_msg:
+        st.success(ingest_msg)
 
     if uploaded:
         ingested = 0
         skipped = 0
+        all_rows = []
+        processed_files = []
 
         for f in uploaded:
             filename = f.name
 
-            if archivo_ya_procesado(conn, filename):
+            if filename in processed_files or archivo_ya_procesado(conn, filename):
                 skipped += 1
                 continue
 
             pdf_bytes = f.read()
 
             try:
-                rows = leer_cartola_internacional(pdf_bytes, filename=filename)
+                rows = _parse_pdf(pdf_bytes, filename)
             except Exception as e:
                 st.error(f"Error leyendo {filename}: {e}")
                 continue
 
             # Optional exclude filters
-            if exclude_terms:
+            if exclude_re:
                 rows = [
                     r for r in rows
-                    if not any(term in (r.get("DESCRIPCION", "").lower()) for term in exclude_terms)
+                    if not exclude_re.search(r.get("DESCRIPCION") or "")
                 ]
 
             if rows:
-                insertar_en_db(conn, rows)
-                registrar_archivo_procesado(conn, filename)
+                all_rows.extend(rows)
+                processed_files.append(filename)
                 ingested += 1
             else:
                 st.warning(
                     f"No se extrajeron filas desde {filename}. No se marca como procesado.")
                 skipped += 1
 
-        st.success(f"Listo. Ingestados: {ingested} | Omitidos: {skipped}")
-        st.rerun()
+        # Only rerun after an actual write: the uploader keeps its files, so on
+        # the rerun they are all skipped as already processed
+        if processed_files:
+            # Single transaction for the whole upload
+            inserted = insertar_lote(conn, all_rows, processed_files)
+
+            # INSERT OR IGNORE: rows already in the DB are not counted
+            st.session_state["ingest_msg"] = (
+                f"Listo. Ingestados: {ingested} | Omitidos: {skipped} | Filas nuevas: {inserted}"
+            )
+            _clear_caches()
+            st.rerun()
+        elif skipped and not ingest_msg:
+            st.info(f"Sin archivos nuevos. Omitidos: {skipped}")
 
     # -------------------------
     # Load DB
     # -------------------------
-    cols, rows = fetch_all(conn)
-    df_db = pd.DataFrame(rows, columns=cols)
+    db_version = _db_mtime(db_path)
+    df_db = _load_df(db_path, db_version)
 
     # -------------------------
     # Dashboard (no graphs)
     # -------------------------
     st.divider()
-    show_dashboard(df_db)
+    show_dashboard(conn, db_version, df_db)
 
     # -------------------------
     # 2) Conciliación / Kame
@@ -162,17 +257,20 @@ def main():
         st.info("No hay transacciones aún.")
         return
 
-    pending = df_db[df_db["FACT_KAME"] == 0].copy()
-    done = df_db[df_db["FACT_KAME"] == 1].copy()
+    has_pending = bool((df_db["FACT_KAME"] == 0).any())
+    done = df_db[df_db["FACT_KAME"] == 1]
 
     # -------- Pendientes --------
     st.markdown("### Pendientes (no ingresadas en Kame)")
 
-    if pending.empty:
+    if not has_pending:
         st.success("No hay pendientes 🎉")
     else:
-        pending = pending.sort_values(["FECHA_OPERACION", "MONTO_TOTAL"], ascending=[
-                                      True, False]).reset_index(drop=True)
+        show_all = st.checkbox(
+            "Mostrar todas las filas pendientes", value=False)
+
+        # Sorted + limited by SQLite (idx_fact_kame_fecha)
+        pending = rows_to_df(*fetch_pending(conn, None if show_all else 20))
         pending["FACT_KAME"] = False  # UI selection only
 
         editable_cols = [
@@ -188,59 +286,61 @@ def main():
             "FACT_KAME",
         ]
 
-        show_all = st.checkbox(
-            "Mostrar todas las filas pendientes", value=False)
-        view_df = pending[editable_cols].copy()
-        if not show_all:
-            view_df = view_df.head(20).copy()
-
-        edited = st.data_editor(
-            view_df,
-            use_container_width=True,
-            hide_index=True,
-            column_config={
-                "_RID_": st.column_config.NumberColumn("ID", disabled=True),
-                "TITULAR_NOMBRE": st.column_config.TextColumn("Titular", disabled=True),
-                "FECHA_OPERACION": st.column_config.TextColumn("Fecha (MM/DD/YY)", disabled=True),
-                "DESCRIPCION": st.column_config.TextColumn("Descripción", disabled=True),
-                "CIUDAD": st.column_config.TextColumn("Ciudad", disabled=True),
-                "PAIS": st.column_config.TextColumn("País", disabled=True),
-                "MONTO_TOTAL": st.column_config.NumberColumn("Monto (US$)", format="%.2f", disabled=True),
-                "TIPO_GASTO": st.column_config.SelectboxColumn(
-                    "Tipo gasto",
-                    options=TIPO_GASTO_OPTIONS,
-                ),
-                "CONCILIADO": st.column_config.CheckboxColumn("Conciliado"),
-                "FACT_KAME": st.column_config.CheckboxColumn("Mover a Kame"),
-            },
-        )
+        view_df = pending[editable_cols]
+
+        # Form: cell edits don't trigger reruns; only the submit buttons do
+        with st.form("kame_edits", clear_on_submit=False):
+            edited = st.data_editor(
+                view_df,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "_RID_": st.column_config.NumberColumn("ID", disabled=True),
+                    "TITULAR_NOMBRE": st.column_config.TextColumn("Titular", disabled=True),
+                    "FECHA_OPERACION": st.column_config.TextColumn("Fecha (MM/DD/YY)", disabled=True),
+                    "DESCRIPCION": st.column_config.TextColumn("Descripción", disabled=True),
+                    "CIUDAD": st.column_config.TextColumn("Ciudad", disabled=True),
+                    "PAIS": st.column_config.TextColumn("País", disabled=True),
+                    "MONTO_TOTAL": st.column_config.NumberColumn("Monto (US$)", format="%.2f", disabled=True),
+                    "TIPO_GASTO": st.column_config.SelectboxColumn(
+                        "Tipo gasto",
+                        options=TIPO_GASTO_OPTIONS,
+                    ),
+                    "CONCILIADO": st.column_config.CheckboxColumn("Conciliado"),
+                    "FACT_KAME": st.column_config.CheckboxColumn("Mover a Kame"),
+                },
+            )
 
-        col1, col2 = st.columns(2)
+            col1, col2 = st.columns(2)
+            submitted_save = col1.form_submit_button("Guardar cambios")
+            submitted_move = col2.form_submit_button("Mover a Kame")
 
-        with col1:
-            if st.button("Guardar cambios"):
-                update_rows(
-                    conn, edited[["_RID_", "TIPO_GASTO", "CONCILIADO"]].to_dict("records"))
-                st.success("Cambios guardados")
-                st.rerun()
+        if submitted_save:
+            update_rows(conn, _update_payload(
+                _changed_rows(edited, view_df)))
+            st.success("Cambios guardados")
+            _clear_caches()
+            st.rerun()
 
-        with col2:
-            selected = edited[edited["FACT_KAME"] == True].copy()
+        if submitted_move:
+            selected = edited[edited["FACT_KAME"] == True]
             valid = (
                 not selected.empty
                 and selected["CONCILIADO"].all()
                 and not selected["TIPO_GASTO"].fillna("").str.strip().eq("").any()
             )
 
-            if st.button("Mover a Kame", disabled=not valid):
+            if valid:
                 # Save edits first
-                update_rows(
-                    conn, edited[["_RID_", "TIPO_GASTO", "CONCILIADO"]].to_dict("records"))
+                update_rows(conn, _update_payload(
+                    _changed_rows(edited, view_df)))
                 mark_rows_as_kame(conn, selected["_RID_"].astype(int).tolist())
                 st.success(f"{len(selected)} movidas a Kame")
+                _clear_caches()
                 st.rerun()
-
-            if (not selected.empty) and (not valid):
+            elif selected.empty:
+                st.info("Selecciona al menos una fila en 'Mover a Kame'.")
+            else:
                 st.info(
                     "Para mover: todas deben estar CONCILIADAS y con TIPO_GASTO definido.")
 
@@ -274,16 +374,21 @@ def main():
     st.divider()
     st.subheader("3) Exportar / Admin")
 
-    st.download_button(
-        "Descargar CSV",
-        df_db.to_csv(index=False).encode("utf-8"),
-        file_name="transacciones_internacional.csv",
-    )
+    # download_button needs the bytes up front: only build them on request
+    if st.button("Preparar CSV"):
+        st.session_state["csv_version"] = db_version
+    if st.session_state.get("csv_version") == db_version:
+        st.download_button(
+            "Descargar CSV",
+            _csv_bytes(db_path, db_version),
+            file_name="transacciones_internacional.csv",
+        )
 
     with st.expander("Reset database (borra todo)"):
         if st.button("RESET DB"):
             reset_db(conn)
             st.warning("DB reseteada.")
+            _clear_caches()
             st.rerun()
 
 
@@ -1,45 +1,103 @@
+import sqlite3
+from typing import Optional
+
 import pandas as pd
 import streamlit as st
 
+from data.database import fetch_filtered, fetch_months, rows_to_df
+
 
 def _parse_dates(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    out["FECHA_DT"] = pd.to_datetime(out["FECHA_OPERACION"], format="%m/%d/%y", errors="coerce")
-    return out
+    # assign() shares the existing columns (copy-on-write); cache=True parses
+    # each distinct date string once (statements repeat a few dozen dates)
+    return df.assign(
+        FECHA_DT=pd.to_datetime(
+            df["FECHA_OPERACION"], format="%m/%d/%y", errors="coerce", cache=True
+        )
+    )
+
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """Dates + numeric coercion on the (already filtered) rows."""
+    df = _parse_dates(df)
+
+    # Numeric safety
+    df["MONTO_TOTAL"] = pd.to_numeric(df["MONTO_TOTAL"], errors="coerce").fillna(0.0)
+    if "MONTO_OPERACION" in df.columns:
+        df["MONTO_OPERACION"] = pd.to_numeric(df["MONTO_OPERACION"], errors="coerce").fillna(0.0)
+
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _months(_conn: sqlite3.Connection, db_version: float) -> list:
+    return fetch_months(_conn)
 
 
-def show_dashboard(df_db: pd.DataFrame) -> None:
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_filtered(
+    _conn: sqlite3.Connection,
+    db_version: float,
+    month: Optional[str],
+    query: Optional[str],
+) -> pd.DataFrame:
+    """
+    Filtering happens in SQLite; only matching rows reach pandas.
+    `_conn` is not hashed: (db_version, month, query) is the cache key.
+    """
+    # Same dtypes as the full table, so both views behave alike downstream
+    return _prepare(rows_to_df(*fetch_filtered(_conn, month=month, query=query)))
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _prepare_all(db_version: float, _df_all: pd.DataFrame) -> pd.DataFrame:
+    """Unfiltered view: the caller's full table, prepared once per DB version."""
+    return _prepare(_df_all)
+
+
+def clear_cache() -> None:
+    """Drop cached months/filtered views (call after writing to the DB)."""
+    _months.clear()
+    _load_filtered.clear()
+    _prepare_all.clear()
+
+
+def show_dashboard(
+    conn: sqlite3.Connection,
+    db_version: float,
+    df_all: Optional[pd.DataFrame] = None,
+) -> None:
+    """
+    `db_version` identifies the current DB snapshot (cache key).
+    `df_all` is the caller's already-loaded full table, reused for the
+    unfiltered view instead of re-selecting every row from SQLite.
+    """
     st.subheader("Dashboard")
 
-    if df_db is None or df_db.empty:
+    months = _months(conn, db_version)
+    if not months:
         st.info("No hay datos aún.")
         return
 
-    df = _parse_dates(df_db)
-
     # Month filter
-    df["MES"] = df["FECHA_DT"].dt.to_period("M").astype(str)
-    months = [m for m in sorted(df["MES"].dropna().unique())]
     month_sel = st.selectbox("Filtrar por mes", ["Todos"] + months, index=0)
 
-    if month_sel != "Todos":
-        df = df[df["MES"] == month_sel].copy()
-
     # Search
     q = st.text_input("Buscar en descripción", value="")
-    if q.strip():
-        df = df[df["DESCRIPCION"].astype(str).str.contains(q.strip(), case=False, na=False)].copy()
 
-    # Numeric safety
-    df["MONTO_TOTAL"] = pd.to_numeric(df["MONTO_TOTAL"], errors="coerce").fillna(0.0)
-    if "MONTO_OPERACION" in df.columns:
-        df["MONTO_OPERACION"] = pd.to_numeric(df["MONTO_OPERACION"], errors="coerce").fillna(0.0)
+    month = None if month_sel == "Todos" else month_sel
+    query = q.strip() or None
+    if month is None and query is None and df_all is not None:
+        df = _prepare_all(db_version, df_all)
+    else:
+        df = _load_filtered(conn, db_version, month, query)
 
     # KPIs
     total = float(df["MONTO_TOTAL"].sum())
     count = int(len(df))
     avg = float(df["MONTO_TOTAL"].mean()) if count else 0.0
-    conc = int((df.get("CONCILIADO", 0) == 1).sum()) if "CONCILIADO" in df.columns else 0
+    vc = df["CONCILIADO"].value_counts() if "CONCILIADO" in df.columns else pd.Series(dtype="int64")
+    conc = int(vc.get(1, 0))
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Total (US$)", f"{total:,.2f}")
@@ -63,15 +121,14 @@ def show_dashboard(df_db: pd.DataFrame) -> None:
         ]
         cols = [c for c in preferred_cols if c in df.columns]
 
-        df_sorted = df.copy()
-        if "FECHA_DT" in df_sorted.columns:
-            df_sorted = df_sorted.sort_values(
+        if "FECHA_DT" in df.columns:
+            df_sorted = df.sort_values(
                 ["FECHA_DT", "MONTO_TOTAL"],
                 ascending=[True, False],
                 na_position="last",
             )
         else:
-            df_sorted = df_sorted.sort_values(
+            df_sorted = df.sort_values(
                 ["FECHA_OPERACION", "MONTO_TOTAL"],
                 ascending=[True, False],
                 na_position="last",
@@ -1,6 +1,72 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
 from pathlib import Path
-from typing import Iterable, Dict, Any, List, Tuple
+from typing import Iterable, Iterator, Dict, Any, List, Optional, Tuple
+
+import pandas as pd
+
+
+# Column order shared by the INSERT statement and the row -> tuple getter.
+# OR IGNORE: rows already stored (ux_trans_dedup) are skipped, not duplicated.
+_INSERT_COLUMNS = (
+    "TITULAR_NOMBRE",
+    "FECHA_OPERACION", "DESCRIPCION", "CIUDAD", "PAIS", "REF_INTERNACIONAL",
+    "MONTO_ORIGEN", "MONTO_OPERACION", "MONTO_TOTAL",
+    "TIPO_GASTO", "FACT_KAME", "ARCHIVO_ORIGEN", "CONCILIADO",
+)
+_INSERT_SQL = (
+    f"INSERT OR IGNORE INTO transacciones({', '.join(_INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_INSERT_COLUMNS))});"
+)
+_ROW_GETTER = itemgetter(*_INSERT_COLUMNS)
+
+
+# Compact in-memory dtypes for the transacciones table (app + dashboard frames).
+# MONTO_* are float64 (not float32: totals are money and would drop cents),
+# pinned so an empty result doesn't come back as object.
+DTYPES = {
+    "_RID_": "int32",
+    "FACT_KAME": "int8",
+    "CONCILIADO": "int8",
+    "MONTO_ORIGEN": "float64",
+    "MONTO_OPERACION": "float64",
+    "MONTO_TOTAL": "float64",
+    "FECHA_OPERACION": "string[pyarrow]",
+    "DESCRIPCION": "string[pyarrow]",
+    "CIUDAD": "string[pyarrow]",
+    "REF_INTERNACIONAL": "string[pyarrow]",
+    "TIPO_GASTO": "string[pyarrow]",
+    "ARCHIVO_ORIGEN": "string[pyarrow]",
+    "PAIS": "category",
+    "TITULAR_NOMBRE": "category",
+}
+
+
+# Serializes all use of a shared connection (see _transaction): a read run while
+# another thread is mid-transaction on the same connection would see its
+# uncommitted rows. Reentrant: _transaction's callers may run reads inside it.
+_CONN_LOCK = threading.RLock()
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection, mode: str = "DEFERRED") -> Iterator[sqlite3.Connection]:
+    """
+    Explicit BEGIN/COMMIT (ROLLBACK on error).
+    Connections from init_db run in autocommit mode (isolation_level=None),
+    so `with conn:` alone would not group statements.
+    Holds _CONN_LOCK: the app shares one connection across sessions/threads,
+    and a second BEGIN on it would fail or mix two sessions' statements.
+    """
+    with _CONN_LOCK:
+        conn.execute(f"BEGIN {mode};")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
 
 
 def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
@@ -14,180 +80,317 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
     Lightweight migrations for existing DBs.
     Adds TITULAR_NOMBRE if it doesn't exist.
     """
-    if _column_exists(conn, "transacciones", "TITULAR_NOMBRE"):
-        return
+    with _CONN_LOCK:
+        if _column_exists(conn, "transacciones", "TITULAR_NOMBRE"):
+            return
 
-    conn.execute("ALTER TABLE transacciones ADD COLUMN TITULAR_NOMBRE TEXT;")
-    conn.commit()
+        conn.execute("ALTER TABLE transacciones ADD COLUMN TITULAR_NOMBRE TEXT;")
 
 
 def init_db(db_path: str) -> sqlite3.Connection:
     """Create/connect SQLite DB and ensure tables exist."""
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS transacciones (
-            FECHA_OPERACION TEXT,
-            DESCRIPCION TEXT,
-            CIUDAD TEXT,
-            PAIS TEXT,
-            REF_INTERNACIONAL TEXT,
-            MONTO_ORIGEN REAL,
-            MONTO_OPERACION REAL,
-            MONTO_TOTAL REAL,
-            TIPO_GASTO TEXT,
-            FACT_KAME INTEGER DEFAULT 0,
-            ARCHIVO_ORIGEN TEXT,
-            CONCILIADO INTEGER DEFAULT 0
-        );
-        """
+    # Autocommit + explicit _transaction() for writes; statement cache is reused
+    # across reruns since the connection itself is cached by the app.
+    # check_same_thread=False: Streamlit reruns may use another worker thread.
+    conn = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=256,
     )
 
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS archivos_procesados (
-            nombre TEXT PRIMARY KEY,
-            fecha_procesado TEXT DEFAULT (datetime('now'))
-        );
-        """
-    )
+    # Single-writer app: WAL + synchronous=NORMAL is durable across app crashes
+    # and at most loses the last commit on power loss. WAL/SHM files live next to db_path.
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA cache_size=-65536;")
+
+    # All DDL in one transaction (one commit instead of one per statement)
+    with _transaction(conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transacciones (
+                FECHA_OPERACION TEXT,
+                DESCRIPCION TEXT,
+                CIUDAD TEXT,
+                PAIS TEXT,
+                REF_INTERNACIONAL TEXT,
+                MONTO_ORIGEN REAL,
+                MONTO_OPERACION REAL,
+                MONTO_TOTAL REAL,
+                TIPO_GASTO TEXT,
+                FACT_KAME INTEGER DEFAULT 0,
+                ARCHIVO_ORIGEN TEXT,
+                CONCILIADO INTEGER DEFAULT 0
+            );
+            """
+        )
 
-    conn.commit()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archivos_procesados (
+                nombre TEXT PRIMARY KEY,
+                fecha_procesado TEXT DEFAULT (datetime('now'))
+            );
+            """
+        )
 
     # ✅ auto-migration
     _ensure_schema(conn)
+    _ensure_indexes(conn)
+    _ensure_fts(conn)
 
     return conn
 
 
-def archivo_ya_procesado(conn: sqlite3.Connection, filename: str) -> bool:
-    cur = conn.execute("SELECT 1 FROM archivos_procesados WHERE nombre = ? LIMIT 1", (filename,))
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    cur = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transacciones_fts' LIMIT 1"
+    )
     return cur.fetchone() is not None
 
 
-def registrar_archivo_procesado(conn: sqlite3.Connection, filename: str) -> None:
-    conn.execute("INSERT OR IGNORE INTO archivos_procesados(nombre) VALUES (?)", (filename,))
-    conn.commit()
+def _ensure_fts(conn: sqlite3.Connection) -> None:
+    """
+    FTS5 index over DESCRIPCION, kept in sync by triggers.
+    trigram tokenizer -> substring search (3+ chars), case-insensitive.
+    Skipped if this SQLite build lacks FTS5/trigram (search falls back to LIKE).
+    """
+    if _has_fts(conn):
+        return
+
+    try:
+        with _transaction(conn):
+            conn.execute(
+                """
+                CREATE VIRTUAL TABLE transacciones_fts USING fts5(
+                    DESCRIPCION,
+                    content='transacciones',
+                    content_rowid='rowid',
+                    tokenize='trigram'
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS transacciones_fts_ai AFTER INSERT ON transacciones BEGIN
+                    INSERT INTO transacciones_fts(rowid, DESCRIPCION) VALUES (new.rowid, new.DESCRIPCION);
+                END;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS transacciones_fts_ad AFTER DELETE ON transacciones BEGIN
+                    INSERT INTO transacciones_fts(transacciones_fts, rowid, DESCRIPCION)
+                    VALUES ('delete', old.rowid, old.DESCRIPCION);
+                END;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS transacciones_fts_au AFTER UPDATE OF DESCRIPCION ON transacciones BEGIN
+                    INSERT INTO transacciones_fts(transacciones_fts, rowid, DESCRIPCION)
+                    VALUES ('delete', old.rowid, old.DESCRIPCION);
+                    INSERT INTO transacciones_fts(rowid, DESCRIPCION) VALUES (new.rowid, new.DESCRIPCION);
+                END;
+                """
+            )
+            # Index rows that existed before the FTS table
+            conn.execute("INSERT INTO transacciones_fts(transacciones_fts) VALUES ('rebuild');")
+    except sqlite3.OperationalError:
+        pass
+
+
+def _ensure_indexes(conn: sqlite3.Connection) -> None:
+    """Create secondary indexes (after migrations, since they reference TITULAR_NOMBRE)."""
+    with _transaction(conn):
+        # Pendientes view: WHERE FACT_KAME = 0 ORDER BY fecha, monto DESC LIMIT n
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_fact_kame_fecha
+            ON transacciones(FACT_KAME, FECHA_OPERACION, MONTO_TOTAL DESC);
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_trans_archivo ON transacciones(ARCHIVO_ORIGEN);")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_trans_fecha ON transacciones(FECHA_OPERACION);")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_trans_conc ON transacciones(CONCILIADO, FACT_KAME);")
+
+        # Same key as the parser's dedupe, so INSERT OR IGNORE drops re-ingested rows.
+        # COALESCE: NULLs are distinct in a UNIQUE index, and TITULAR_NOMBRE is
+        # NULL whenever the header wasn't found.
+        try:
+            conn.execute(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_trans_dedup
+                ON transacciones(
+                    COALESCE(TITULAR_NOMBRE, ''), FECHA_OPERACION, DESCRIPCION,
+                    COALESCE(PAIS, ''), MONTO_OPERACION, ARCHIVO_ORIGEN
+                );
+                """
+            )
+        except sqlite3.IntegrityError:
+            # Older DB already holds duplicates: keep it usable, just without DB-level dedupe
+            pass
+
+
+def archivo_ya_procesado(conn: sqlite3.Connection, filename: str) -> bool:
+    with _CONN_LOCK:
+        cur = conn.execute("SELECT 1 FROM archivos_procesados WHERE nombre = ? LIMIT 1", (filename,))
+        return cur.fetchone() is not None
+
+
+def _insert_rows(conn: sqlite3.Connection, rows: Iterable[Dict[str, Any]]) -> int:
+    """
+    executemany INSERT of parsed rows (no commit; caller owns the transaction).
+    Rows must carry every key in _INSERT_COLUMNS, as leer_cartola_internacional does.
+    Returns how many rows were actually inserted (duplicates are ignored).
+    """
+    cur = conn.executemany(_INSERT_SQL, map(_ROW_GETTER, rows))
+    return cur.rowcount
 
 
-def insertar_en_db(conn: sqlite3.Connection, rows: Iterable[Dict[str, Any]]) -> int:
+def insertar_lote(
+    conn: sqlite3.Connection,
+    rows: Iterable[Dict[str, Any]],
+    archivos: Iterable[str],
+) -> int:
+    """
+    Insert rows from several PDFs and register their filenames
+    in a single transaction (one commit / fsync for the whole upload).
+    """
     rows = list(rows)
-    if not rows:
+    archivos = list(archivos)
+    if not rows and not archivos:
         return 0
 
-    # Ensure schema before inserting (safe even if called repeatedly)
     _ensure_schema(conn)
 
-    # Insert depending on whether TITULAR_NOMBRE exists in schema
-    has_titular = _column_exists(conn, "transacciones", "TITULAR_NOMBRE")
-
-    if has_titular:
+    inserted = 0
+    with _transaction(conn, "IMMEDIATE"):
+        if rows:
+            inserted = _insert_rows(conn, rows)
         conn.executemany(
-            """
-            INSERT INTO transacciones(
-                TITULAR_NOMBRE,
-                FECHA_OPERACION, DESCRIPCION, CIUDAD, PAIS, REF_INTERNACIONAL,
-                MONTO_ORIGEN, MONTO_OPERACION, MONTO_TOTAL,
-                TIPO_GASTO, FACT_KAME, ARCHIVO_ORIGEN, CONCILIADO
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-            [
-                (
-                    r.get("TITULAR_NOMBRE", None),
-                    r.get("FECHA_OPERACION", ""),
-                    r.get("DESCRIPCION", ""),
-                    r.get("CIUDAD", ""),
-                    r.get("PAIS", ""),
-                    r.get("REF_INTERNACIONAL", ""),
-                    r.get("MONTO_ORIGEN", None),
-                    r.get("MONTO_OPERACION", None),
-                    r.get("MONTO_TOTAL", None),
-                    r.get("TIPO_GASTO", ""),
-                    int(r.get("FACT_KAME", 0)),
-                    r.get("ARCHIVO_ORIGEN", ""),
-                    int(r.get("CONCILIADO", 0)),
-                )
-                for r in rows
-            ],
+            "INSERT OR IGNORE INTO archivos_procesados(nombre) VALUES (?)",
+            [(a,) for a in archivos],
         )
-    else:
-        # fallback (shouldn't happen because _ensure_schema adds it)
-        conn.executemany(
-            """
-            INSERT INTO transacciones(
-                FECHA_OPERACION, DESCRIPCION, CIUDAD, PAIS, REF_INTERNACIONAL,
-                MONTO_ORIGEN, MONTO_OPERACION, MONTO_TOTAL,
-                TIPO_GASTO, FACT_KAME, ARCHIVO_ORIGEN, CONCILIADO
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-            [
-                (
-                    r.get("FECHA_OPERACION", ""),
-                    r.get("DESCRIPCION", ""),
-                    r.get("CIUDAD", ""),
-                    r.get("PAIS", ""),
-                    r.get("REF_INTERNACIONAL", ""),
-                    r.get("MONTO_ORIGEN", None),
-                    r.get("MONTO_OPERACION", None),
-                    r.get("MONTO_TOTAL", None),
-                    r.get("TIPO_GASTO", ""),
-                    int(r.get("FACT_KAME", 0)),
-                    r.get("ARCHIVO_ORIGEN", ""),
-                    int(r.get("CONCILIADO", 0)),
-                )
-                for r in rows
-            ],
+
+    return inserted
+
+
+def rows_to_df(cols: List[str], rows: List[tuple]) -> pd.DataFrame:
+    """(cols, rows) from the fetch_* helpers as a DataFrame with DTYPES applied."""
+    df = pd.DataFrame(rows, columns=cols)
+    return df.astype({k: v for k, v in DTYPES.items() if k in df.columns})
+
+
+def fetch_all_df(conn: sqlite3.Connection, dtype: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Whole table (plus _RID_) as a DataFrame, built directly from the cursor."""
+    with _CONN_LOCK:
+        return pd.read_sql_query("SELECT rowid AS _RID_, * FROM transacciones", conn, dtype=dtype)
+
+
+# MM/DD/YY -> YYYY-MM (same month key the dashboard shows)
+_MES_SQL = "'20' || substr(FECHA_OPERACION, 7, 2) || '-' || substr(FECHA_OPERACION, 1, 2)"
+_FECHA_OK_SQL = "FECHA_OPERACION GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9]'"
+
+
+def fetch_months(conn: sqlite3.Connection) -> List[str]:
+    """Distinct YYYY-MM months present, ascending."""
+    with _CONN_LOCK:
+        cur = conn.execute(
+            f"SELECT DISTINCT {_MES_SQL} AS MES FROM transacciones WHERE {_FECHA_OK_SQL} ORDER BY MES;"
         )
+        return [r[0] for r in cur.fetchall()]
 
-    conn.commit()
-    return len(rows)
 
+def fetch_filtered(
+    conn: sqlite3.Connection,
+    month: Optional[str] = None,
+    query: Optional[str] = None,
+) -> Tuple[List[str], List[tuple]]:
+    """
+    Like fetch_all_df, filtered in SQLite: `month` is YYYY-MM,
+    `query` a case-insensitive substring of DESCRIPCION.
+    """
+    where = []
+    params: List[Any] = []
+    if month:
+        where.append(f"{_FECHA_OK_SQL} AND {_MES_SQL} = ?")
+        params.append(month)
+    with _CONN_LOCK:
+        if query and len(query) >= 3 and _has_fts(conn):
+            # Quoted trigram phrase = substring match, served by the FTS index
+            where.append("rowid IN (SELECT rowid FROM transacciones_fts WHERE transacciones_fts MATCH ?)")
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("DESCRIPCION LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
 
-def fetch_all(conn: sqlite3.Connection) -> Tuple[List[str], List[tuple]]:
-    cur = conn.execute("SELECT rowid AS _RID_, * FROM transacciones")
-    cols = [d[0] for d in cur.description]
-    rows = cur.fetchall()
+        sql = "SELECT rowid AS _RID_, * FROM transacciones"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+
+        cur = conn.execute(sql, params)
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
     return cols, rows
 
 
-def update_rows(conn: sqlite3.Connection, updates: List[Dict[str, Any]]) -> None:
-    conn.executemany(
-        """
-        UPDATE transacciones
-        SET TIPO_GASTO = ?, CONCILIADO = ?
-        WHERE rowid = ?;
-        """,
-        [
-            (
-                (u.get("TIPO_GASTO") or ""),
-                int(bool(u.get("CONCILIADO"))),
-                int(u["_RID_"]),
-            )
-            for u in updates
-        ],
-    )
-    conn.commit()
+def fetch_pending(conn: sqlite3.Connection, limit: Optional[int] = None) -> Tuple[List[str], List[tuple]]:
+    """Rows not yet in Kame, sorted by fecha ASC, monto DESC (served by idx_fact_kame_fecha)."""
+    with _CONN_LOCK:
+        cur = conn.execute(
+            """
+            SELECT rowid AS _RID_, * FROM transacciones
+            WHERE FACT_KAME = 0
+            ORDER BY FECHA_OPERACION ASC, MONTO_TOTAL DESC
+            LIMIT ?;
+            """,
+            (limit if limit is not None else -1,),
+        )
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    return cols, rows
+
+
+def update_rows(conn: sqlite3.Connection, updates: Iterable[Tuple[str, int, int]]) -> None:
+    """
+    Bulk update; `updates` are (TIPO_GASTO, CONCILIADO, _RID_) tuples.
+    Staged in a temp table, then applied with a single UPDATE statement.
+    """
+    with _transaction(conn):
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS _upd(rid INTEGER PRIMARY KEY, tg TEXT, cc INTEGER);"
+        )
+        conn.execute("DELETE FROM _upd;")
+        # OR REPLACE: if a rowid repeats, the last update wins (as with per-row UPDATEs)
+        conn.executemany("INSERT OR REPLACE INTO _upd(tg, cc, rid) VALUES (?, ?, ?);", updates)
+        conn.execute(
+            """
+            UPDATE transacciones
+            SET TIPO_GASTO = (SELECT tg FROM _upd WHERE _upd.rid = transacciones.rowid),
+                CONCILIADO = (SELECT cc FROM _upd WHERE _upd.rid = transacciones.rowid)
+            WHERE rowid IN (SELECT rid FROM _upd);
+            """
+        )
 
 
 def mark_rows_as_kame(conn: sqlite3.Connection, rowids: List[int]) -> None:
     if not rowids:
         return
-    conn.executemany(
-        """
-        UPDATE transacciones
-        SET FACT_KAME = 1
-        WHERE rowid = ?;
-        """,
-        [(int(rid),) for rid in rowids],
-    )
-    conn.commit()
+    placeholders = ", ".join("?" * len(rowids))
+    with _transaction(conn):
+        conn.execute(
+            f"UPDATE transacciones SET FACT_KAME = 1 WHERE rowid IN ({placeholders});",
+            [int(rid) for rid in rowids],
+        )
 
 
 def reset_db(conn: sqlite3.Connection) -> None:
-    conn.execute("DELETE FROM transacciones;")
-    conn.execute("DELETE FROM archivos_procesados;")
-    conn.commit()
+    with _transaction(conn):
+        conn.execute("DELETE FROM transacciones;")
+        conn.execute("DELETE FROM archivos_procesados;")
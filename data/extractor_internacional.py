@@ -1,30 +1,46 @@
 from __future__ import annotations
 
-import io
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import pdfplumber
-from unidecode import unidecode
+import fitz  # PyMuPDF
 
 
 DATE_RE = re.compile(r"\b\d{2}/\d{2}/\d{2}\b")
 PAIS_RE = re.compile(r"^[A-Z]{2}$")
 REF_RE = re.compile(r"^\d{10,}$")
 
-# Examples: 49,44 ; -17,35 ; 49.640,00
-AMOUNT_RE = re.compile(r"^-?\d{1,3}(?:\.\d{3})*(?:,\d{2})$|^-?\d+(?:,\d{2})$")
+HEADER_TITULAR_RE = re.compile(r"NOMBRE DEL TITULAR\s+([A-ZÁÉÍÓÚÑ ]+)\s+N° DE TARJETA", re.DOTALL)
+HEADER_FECHA_RE = re.compile(r"FECHA ESTADO DE CUENTA\s+(\d{2}/\d{2}/\d{4})")
+
+
+# Thousands "." dropped, decimal "," -> ".", "$"/spaces dropped
+_AMOUNT_TRANS = str.maketrans({".": "", ",": ".", "$": "", " ": ""})
+
+
+# Unaccented words that every section-toggling heading contains
+# ("... INFORMACION DE TRANSACCIONES", "... COMISIONES, ...", "TOTAL TARJETA"),
+# wherever it sits in the line
+_SECTION_HINTS = ("TRANSACCIONES", "COMISIONES", "TOTAL")
+
+# Spanish accents only: enough for the fixed section headings we match
+_ACCENT_TRANS = str.maketrans("áéíóúüñÁÉÍÓÚÜÑ", "AEIOUUNAEIOUUN")
 
 
 def _norm(s: str) -> str:
     """Uppercase + remove accents (robust PDF matching)."""
-    return unidecode(s).upper()
+    return s.translate(_ACCENT_TRANS).upper()
+
+
+def _may_toggle_section(line: str) -> bool:
+    up = line.upper()
+    return any(h in up for h in _SECTION_HINTS)
 
 
 def _to_float(amount_str: str) -> float:
-    s = amount_str.strip().replace("US$", "").replace("$", "")
-    s = s.replace(".", "").replace(",", ".")
-    return float(s)
+    # "1.234,56" -> "1234.56" in a single translate pass
+    return float(amount_str.replace("US$", "").translate(_AMOUNT_TRANS))
 
 
 def _ddmmyy_to_mmddyy(ddmmyy: str) -> str:
@@ -45,17 +61,13 @@ def _extract_header_fields(full_text: str) -> Tuple[Optional[str], Optional[str]
     fecha_estado = None
 
     # Full name
-    m = re.search(
-        r"NOMBRE DEL TITULAR\s+([A-ZÁÉÍÓÚÑ ]+)\s+N° DE TARJETA",
-        full_text,
-        re.DOTALL,
-    )
+    m = HEADER_TITULAR_RE.search(full_text)
     if m:
         titular_full = " ".join(m.group(1).split()).strip()
         titular_first = titular_full.split()[0]
 
     # Statement date (not critical, but used for archivo_origen)
-    m2 = re.search(r"FECHA ESTADO DE CUENTA\s+(\d{2}/\d{2}/\d{4})", full_text)
+    m2 = HEADER_FECHA_RE.search(full_text)
     if m2:
         fecha_estado = m2.group(1)
 
@@ -74,15 +86,38 @@ def _build_archivo_origen(
     return filename
 
 
-def _find_trailing_amounts(tokens: List[str]) -> List[str]:
-    trailing = []
-    for t in reversed(tokens):
-        if AMOUNT_RE.match(t):
-            trailing.append(t)
-        else:
-            if trailing:
-                break
-    return list(reversed(trailing))
+def _is_amount(tok: str) -> bool:
+    r"""
+    Amount token, e.g. 49,44 ; -17,35 ; 49.640,00
+    Same grammar as ^-?\d{1,3}(\.\d{3})*,\d{2}$ | ^-?\d+,\d{2}$ without the regex VM.
+    """
+    if tok[:1] == "-":
+        tok = tok[1:]
+    head, sep, tail = tok.rpartition(",")
+    if not sep or len(tail) != 2 or not tail.isdecimal():
+        return False
+    if head.isdecimal():
+        return True
+    groups = head.split(".")
+    return (
+        1 <= len(groups[0]) <= 3
+        and all(g.isdecimal() for g in groups)
+        and all(len(g) == 3 for g in groups[1:])
+    )
+
+
+def _find_trailing_amounts(tokens: List[str]) -> Tuple[int, int]:
+    """
+    (start, end) bounds of the last run of amount tokens; start == end if none.
+    Index scan from the right: no reversed copies.
+    """
+    end = len(tokens)
+    while end and not _is_amount(tokens[end - 1]):
+        end -= 1
+    start = end
+    while start and _is_amount(tokens[start - 1]):
+        start -= 1
+    return start, end
 
 
 def _split_desc_city_pais(tokens_after_date: List[str], pais: str) -> Tuple[str, str]:
@@ -118,22 +153,35 @@ def _parse_transaction_line(
     line: str,
     archivo_origen: str,
     titular_first_name: Optional[str],
+    date_match: Optional[re.Match] = None,
 ) -> Optional[Dict[str, Any]]:
+    """
+    `line` must be whitespace-normalized (single spaces).
+    `date_match` is DATE_RE.search(line) if the caller already ran it.
+    """
     tokens = line.split()
 
-    try:
-        date_idx = next(i for i, t in enumerate(tokens) if DATE_RE.fullmatch(t))
-    except StopIteration:
-        return None
-
-    trailing = _find_trailing_amounts(tokens)
-    if not trailing:
+    date_idx = None
+    if date_match is not None:
+        # Token index = spaces before the match (line is single-spaced)
+        i = line.count(" ", 0, date_match.start())
+        if tokens[i] == date_match.group(0):
+            date_idx = i
+    if date_idx is None:
+        try:
+            date_idx = next(i for i, t in enumerate(tokens) if DATE_RE.fullmatch(t))
+        except StopIteration:
+            return None
+
+    amt_start, amt_end = _find_trailing_amounts(tokens)
+    n_amounts = amt_end - amt_start
+    if not n_amounts:
         return None
 
-    monto_origen = trailing[-2] if len(trailing) >= 2 else None
-    monto_usd = trailing[-1]
+    monto_origen = tokens[amt_end - 2] if n_amounts >= 2 else None
+    monto_usd = tokens[amt_end - 1]
 
-    desc_tokens = tokens[date_idx + 1 : len(tokens) - len(trailing)]
+    desc_tokens = tokens[date_idx + 1 : len(tokens) - n_amounts]
 
     pais = ""
     ciudad = ""
@@ -175,25 +223,56 @@ def _parse_transaction_line(
     }
 
 
-def leer_cartola_internacional(pdf_bytes: bytes, filename: str = "archivo.pdf") -> List[Dict[str, Any]]:
-    rows: List[Dict[str, Any]] = []
+# Pages searched for titular / statement date
+_HEADER_MAX_PAGES = 2
 
-    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-        page_texts = [(p.extract_text() or "") for p in pdf.pages]
-        full_text = "\n".join(page_texts)
 
-        titular_full, titular_first, fecha_estado = _extract_header_fields(full_text)
+def _iter_page_texts(doc: "fitz.Document") -> Iterator[str]:
+    """
+    Yield page texts in order, one at a time (no whole-PDF text in memory).
+    Serial on purpose: MuPDF documents aren't thread-safe and extraction holds the GIL.
+    """
+    for p in doc:
+        # sort=True rebuilds visual rows by position (as pdfplumber did); plain
+        # "text" follows content-stream order and can split table cells apart
+        yield p.get_text("text", sort=True) or ""
+
+
+def leer_cartola_internacional(pdf_bytes: bytes, filename: str = "archivo.pdf") -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    # Dedupe in-stream (headers/footers repeat across pages)
+    seen: set = set()
+
+    # PyMuPDF: C text extraction, no pdfminer layout analysis
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pages = _iter_page_texts(doc)
+
+        # Header fields live on the first page(s); don't join the whole PDF
+        header_pages: List[str] = []
+        titular_full = titular_first = fecha_estado = None
+        for text in pages:
+            header_pages.append(text)
+            titular_full, titular_first, fecha_estado = _extract_header_fields("\n".join(header_pages))
+            if (titular_full and fecha_estado) or len(header_pages) >= _HEADER_MAX_PAGES:
+                break
         archivo_origen = _build_archivo_origen(filename, titular_full, fecha_estado)
 
         in_transacciones = False
         in_comisiones = False
 
-        for t in page_texts:
+        # Header pages first, then the rest as they are extracted
+        for t in chain(header_pages, pages):
             for raw_line in t.splitlines():
                 line = " ".join(raw_line.split())
                 if not line:
                     continue
 
+                # Most lines are neither transactions (no date) nor section
+                # headings: skip them before normalizing
+                date_match = DATE_RE.search(line)
+                if not date_match and not _may_toggle_section(line):
+                    continue
+
                 u = _norm(line)
 
                 if "2. INFORMACION DE TRANSACCIONES" in u:
@@ -227,29 +306,29 @@ def leer_cartola_internacional(pdf_bytes: bytes, filename: str = "archivo.pdf")
                 if not (in_transacciones or in_comisiones):
                     continue
 
-                if not DATE_RE.search(line):
+                if not date_match:
                     continue
 
                 row = _parse_transaction_line(
                     line,
                     archivo_origen,
                     titular_first_name=titular_first,
+                    date_match=date_match,
                 )
-                if row:
-                    rows.append(row)
-
-    # Deduplicate
-    uniq = {}
-    for r in rows:
-        key = (
-            r["TITULAR_NOMBRE"],
-            r["FECHA_OPERACION"],
-            r["DESCRIPCION"],
-            r.get("PAIS", ""),
-            r["MONTO_OPERACION"],
-            r["ARCHIVO_ORIGEN"],
-        )
-        uniq[key] = r
-
-    return list(uniq.values())
-# ---end--- 
+                if not row:
+                    continue
+
+                key = (
+                    row["TITULAR_NOMBRE"],
+                    row["FECHA_OPERACION"],
+                    row["DESCRIPCION"],
+                    row.get("PAIS", ""),
+                    row["MONTO_OPERACION"],
+                    row["ARCHIVO_ORIGEN"],
+                )
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append(row)
+
+    return rows